@@ -1,41 +1,67 @@
-import matplotlib.pyplot as plt
+import io
+
+import bottleneck as bn
+import fsspec
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import streamlit as st
-from statsmodels.tsa.holtwinters import ExponentialSmoothing as HWES
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from numba import njit
+from pyarrow import csv as pa_csv
+from scipy.optimize import minimize
 
 
-@st.cache
-def load_data():
-    # Load the data
-    vaccination = pd.read_csv(
-        "https://raw.githubusercontent.com/owid/covid-19-data/master/public/data/vaccinations/vaccinations.csv"
-    )
-
+@st.cache_data(persist="disk", max_entries=2, show_spinner="Loading vaccination data…")
+def load_data(data_day):
     # Save the source
     data_source = "https://github.com/owid/covid-19-data"
 
-    # Filter country
+    # Filter country and columns
     country_filter = "PHL"
-    vaccination = vaccination[vaccination["iso_code"] == country_filter]
-
-    # Filter columns
     columns = ["date", "people_vaccinated", "people_fully_vaccinated"]
-    vaccination = vaccination[columns]
-
-    # Transform date
-    vaccination["date"] = pd.to_datetime(vaccination["date"])
-
-    # Apply forward-fill for dates with no data
-    vaccination['people_vaccinated'] = vaccination['people_vaccinated'].ffill()
-    vaccination['people_fully_vaccinated'] = vaccination['people_fully_vaccinated'].ffill()
-
-    # Replace NA with 0
-    vaccination = vaccination.fillna(0)
+    fill_columns = ["people_vaccinated", "people_fully_vaccinated"]
+
+    # Fetch the CSV in one large buffered read, parsing only the needed columns
+    with fsspec.open(
+        "https://raw.githubusercontent.com/owid/covid-19-data/master/public/data/vaccinations/vaccinations.csv",
+        "rb",
+        block_size=32 << 20
+    ) as f:
+        table = pa_csv.read_csv(
+            f,
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=["iso_code"] + columns,
+                column_types={
+                    "date": pa.timestamp("ns"),
+                    "people_vaccinated": pa.float64(),
+                    "people_fully_vaccinated": pa.float64()
+                }
+            )
+        )
+
+    # Keep the country rows, in date order
+    table = table.filter(pc.equal(table["iso_code"], country_filter)).sort_by("date")
+    vaccination = table.select(columns).to_pandas(split_blocks=True)
+
+    # Apply forward-fill for dates with no data, then replace NA with 0
+    filled = bn.push(vaccination[fill_columns].to_numpy(), axis=0)
+    vaccination = vaccination.assign(**dict(zip(fill_columns, filled.T))).fillna(0)
+
+    # Precompute the plot arrays (counts in millions); float32 is only safe here,
+    # since counts above 2**24 are not exact in float32
+    plot_data = {
+        "dates": vaccination["date"].to_numpy(),
+        "v_m": (vaccination["people_vaccinated"].to_numpy() * 1e-6).astype(np.float32),
+        "fv_m": (vaccination["people_fully_vaccinated"].to_numpy() * 1e-6).astype(np.float32)
+    }
 
-    return vaccination, data_source
+    return vaccination, data_source, plot_data
 
 
-@st.cache
+@st.cache_data
 def initialize_population_statistics():
     # Store population statistics
     population = 111265058
@@ -44,43 +70,182 @@ def initialize_population_statistics():
     return population, herd_immunity_factor, target_vaccination
 
 
-@st.cache
 def get_latest_numbers(vaccination):
     # Get latest numbers
-    recent_date = max(vaccination["date"])
-    recent_data = vaccination[vaccination["date"] == recent_date]
-    recent_people_vaccinated = int(recent_data["people_vaccinated"])
-    recent_people_fully_vaccinated = int(recent_data["people_fully_vaccinated"])
+    recent_date = vaccination["date"].iat[-1]
+    recent_people_vaccinated = int(vaccination["people_vaccinated"].iat[-1])
+    recent_people_fully_vaccinated = int(vaccination["people_fully_vaccinated"].iat[-1])
     return recent_date, recent_people_vaccinated, recent_people_fully_vaccinated
 
 
-def descriptive_analytics():
-    # Load the data
-    vaccination, data_source = load_data()
+@st.cache_data(ttl=3600, show_spinner=False)
+def load_context():
+    # Gather everything the pages need in one cached call; the data cache is
+    # persisted to disk, which ignores TTL, so it is keyed by day instead.
+    # max_entries only bounds the in-memory copy: one small pickle per day is
+    # left in the Streamlit cache directory until it is cleared
+    data_day = pd.Timestamp.now(tz="UTC").strftime("%Y-%m-%d")
+    vaccination, data_source, plot_data = load_data(data_day)
     recent_date, recent_people_vaccinated, recent_people_fully_vaccinated = get_latest_numbers(vaccination)
+    population, herd_immunity_factor, target_vaccination = initialize_population_statistics()
 
-    # Write the title and the subheader
-    st.title(":syringe: PH Vaccination Rate: Where We Are")
-    st.subheader(
-        f"This visualization aims to provide real-time data on the current state of vaccination in the Philippines. "
-        f"Data was updated last {recent_date.strftime('%b %d, %Y')} from Our World in Data."
+    # Prepare the forecast series; it is keyed by its raw bytes and last date
+    series = prepare_forecast_data(vaccination)["people_fully_vaccinated"]
+    series_key = (series.to_numpy().tobytes(), series.index[-1])
+    return (
+        vaccination, data_source, plot_data,
+        recent_date, recent_people_vaccinated, recent_people_fully_vaccinated,
+        population, herd_immunity_factor, target_vaccination,
+        series, series_key
     )
 
+
+def prepare_forecast_data(vaccination):
+    # Prepare the data
+    vaccination = vaccination[["date", "people_fully_vaccinated"]]
+    vaccination = vaccination.set_index('date')
+
+    # Drop 0 values
+    vaccination = vaccination[vaccination["people_fully_vaccinated"] != 0]
+    return vaccination
+
+
+@njit(cache=True, error_model="numpy")
+def holt_winters_smooth(y, alpha, beta, gamma, period, initial_states):
+    # Additive trend, multiplicative seasonality; initial_states holds the
+    # initial level, the initial trend and one factor per season
+    level = initial_states[0]
+    trend = initial_states[1]
+    season = np.empty(len(y) + period)
+    season[:period] = initial_states[2:]
+
+    # Run the recurrence, summing the squared one-step-ahead errors
+    sse = 0.0
+    for t in range(len(y)):
+        previous = level + trend
+        error = y[t] - previous * season[t]
+        sse += error * error
+        level = alpha * y[t] / season[t] + (1 - alpha) * previous
+        trend = beta * (level - previous + trend) + (1 - beta) * trend
+        season[t + period] = gamma * y[t] / previous + (1 - gamma) * season[t]
+    return level, trend, season, sse
+
+
+@njit(cache=True, error_model="numpy")
+def holt_winters_sse(initial_states, y, alpha, beta, gamma, period):
+    return holt_winters_smooth(y, alpha, beta, gamma, period, initial_states)[3]
+
+
+@njit(cache=True, error_model="numpy")
+def holt_winters_forecast(y, alpha, beta, gamma, period, initial_states, horizon):
+    level, trend, season, sse = holt_winters_smooth(y, alpha, beta, gamma, period, initial_states)
+
+    # Forecast; like statsmodels 0.12, the last step of each season reuses the
+    # factor from before the final update
+    n = len(y)
+    forecast = np.empty(horizon)
+    for h in range(horizon):
+        if h < period - 1:
+            factor = season[n + h]
+        else:
+            factor = season[n - 1 + (h - period + 1) % period]
+        forecast[h] = (level + (h + 1) * trend) * factor
+    return forecast
+
+
+def estimate_initial_states(y, alpha, beta, gamma, period):
+    # Start from the statsmodels 0.12 initial values
+    level = y[::period].mean()
+    trend = ((y[period:2 * period] - y[:period]) / period).mean()
+    initial_states = np.concatenate(([level, trend], y[:period] / level))
+
+    # Estimate the initial states by minimizing the SSE, as statsmodels did
+    # when no initialization method was given
+    bounds = [(0.0, None), (None, None)] + [(0.0, None)] * period
+    result = minimize(
+        holt_winters_sse,
+        initial_states,
+        args=(y, alpha, beta, gamma, period),
+        method="SLSQP",
+        bounds=bounds
+    )
+
+    # SLSQP can push seasonal factors onto their zero bound and return a
+    # non-finite or worse fit; keep the starting values in that case
+    start_sse = holt_winters_sse(initial_states, y, alpha, beta, gamma, period)
+    if not np.isfinite(result.fun) or not np.all(np.isfinite(result.x)) or result.fun > start_sse:
+        return initial_states
+    return result.x
+
+
+@st.cache_data(max_entries=2)
+def fit_and_forecast(_series, series_key, target):
+    # The smoothing constants are fixed; only the initial states are estimated
+    y = _series.to_numpy(np.float64)
+    alpha, beta, gamma, period = 0.4210526, 0.0526316, 0.5789474, 7
+    initial_states = estimate_initial_states(y, alpha, beta, gamma, period)
+
+    # Forecast, doubling the horizon until the target is reached
+    forecast_horizon = 128
+    while True:
+        prediction_values = holt_winters_forecast(y, alpha, beta, gamma, period, initial_states, forecast_horizon)
+        if prediction_values.max() >= target or forecast_horizon >= 2048:
+            break
+        forecast_horizon *= 2
+    return prediction_values
+
+
+def decimate(x, y, target=1500):
+    # Keep at most about `target` points; the figure is only ~1200 pixels wide
+    step = max(1, len(x) // target)
+    return x[::step], y[::step]
+
+
+@st.cache_data(max_entries=2)
+def render_descriptive_png(_plot_data, dates_key):
+    # Render the figure once per data update; the arrays are keyed by dates_key
+    plot_data = _plot_data
+
     # Plot the data
-    fig, ax = plt.subplots(figsize=(6, 3), dpi=200)
+    fig = Figure(figsize=(6, 3), dpi=200)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
     ax.plot(
-        vaccination['date'],
-        vaccination['people_vaccinated'] / 1000000,
+        *decimate(plot_data["dates"], plot_data["v_m"]),
         label="Total Number of Vaccinated (1st dose)"
     )
     ax.plot(
-        vaccination['date'],
-        vaccination['people_fully_vaccinated'] / 1000000,
+        *decimate(plot_data["dates"], plot_data["fv_m"]),
         label="Total Number of Fully Vaccinated (2nd dose)"
     )
     ax.legend(loc="upper left")
     ax.set_ylabel("Vaccinated Inviduals (in millions)")
-    st.pyplot(fig)
+
+    # Save the figure as PNG
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=200, bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def descriptive_analytics():
+    # Load the data
+    (
+        vaccination, data_source, plot_data,
+        recent_date, recent_people_vaccinated, recent_people_fully_vaccinated,
+        population, herd_immunity_factor, target_vaccination,
+        series, series_key
+    ) = load_context()
+
+    # Write the title and the subheader
+    st.title(":syringe: PH Vaccination Rate: Where We Are")
+    st.subheader(
+        f"This visualization aims to provide real-time data on the current state of vaccination in the Philippines. "
+        f"Data was updated last {recent_date.strftime('%b %d, %Y')} from Our World in Data."
+    )
+
+    # Plot the data
+    dates_key = (vaccination["date"].iloc[-1], len(vaccination))
+    st.image(render_descriptive_png(plot_data, dates_key), use_column_width=True)
     st.caption(f"Source: COVID-19 Dataset from Our World in Data ({data_source}).")
 
     # Print recent numbers
@@ -92,43 +257,25 @@ def descriptive_analytics():
 
 def predictive_analytics():
     # Load the data
-    vaccination, data_source = load_data()
-    population, herd_immunity_factor, target_vaccination = initialize_population_statistics()
+    (
+        vaccination, data_source, plot_data,
+        recent_date, recent_people_vaccinated, recent_people_fully_vaccinated,
+        population, herd_immunity_factor, target_vaccination,
+        series, series_key
+    ) = load_context()
 
-    # Initialize forecast horizon
-    forecast_horizon = 1000
+    # Save the training end date
+    train_end = vaccination["date"].iloc[-1]
 
-    # Generate predict_start and predict_end date
-    train_end = max(vaccination["date"])
+    # Fit the model and forecast
+    prediction_values = fit_and_forecast(series, series_key, target_vaccination)
+
+    # Generate predict_start and predict_end date from the horizon actually used
+    forecast_horizon = len(prediction_values)
     predict_start = train_end + pd.Timedelta(days=1)
     predict_end = predict_start + pd.Timedelta(days=forecast_horizon - 1)
     prediction_date_range = pd.date_range(start=predict_start, end=predict_end)
 
-    # Prepare the data
-    vaccination = vaccination[["date", "people_fully_vaccinated"]]
-    vaccination.set_index('date', inplace=True)
-
-    # Drop 0 values
-    vaccination = vaccination[vaccination["people_fully_vaccinated"] != 0]
-
-    # Initialize the model
-    model = HWES(
-        endog=vaccination["people_fully_vaccinated"],
-        trend='add',
-        seasonal='mul',
-        freq="D"
-    )
-
-    # Fit the model
-    model_fit = model.fit(
-        smoothing_level=0.4210526,
-        smoothing_trend=0.0526316,
-        smoothing_seasonal=0.5789474
-    )
-
-    # Forecast
-    prediction_values = model_fit.forecast(forecast_horizon)
-
     # Create dataframe for predictions
     predictions_dictionary = {
         'date': prediction_date_range,
@@ -144,7 +291,7 @@ def predictive_analytics():
     predictions = predictions[vaccinated_filter]
 
     # Target
-    herd_immunity_date = max(predictions.index) + pd.Timedelta(days=1)
+    herd_immunity_date = predictions.index[-1] + pd.Timedelta(days=1)
 
     # Write the title and subheader
     st.title(":syringe: PH Vaccination Rate: Forecast")
@@ -154,27 +301,40 @@ def predictive_analytics():
     )
 
     # Plot the data
-    fig, ax = plt.subplots(figsize=(6, 3), dpi=200)
-    ax.plot(
-        vaccination.index,
-        vaccination["people_fully_vaccinated"] / 1000000,
-        color="tab:blue",
-        label="Fully vaccinated individuals (actual)"
-    )
-    ax.plot(
-        predictions.index,
-        predictions["people_fully_vaccinated"] / 1000000,
-        color="tab:orange",
-        label="Fully vaccinated individuals (forecasted)"
-    )
-    ax.legend(loc="upper left")
-    ax.set_ylabel("Vaccinated Inviduals (in millions)")
+    nonzero = plot_data["fv_m"] != 0
+    actual = decimate(plot_data["dates"][nonzero], plot_data["fv_m"][nonzero])
+    forecasted = decimate(predictions.index, predictions["people_fully_vaccinated"] / 1000000)
+    if "forecast_fig" not in st.session_state:
+        # Build the figure once per session
+        fig = Figure(figsize=(6, 3), dpi=200)
+        FigureCanvasAgg(fig)
+        ax = fig.subplots()
+        line_actual, = ax.plot(
+            *actual,
+            color="tab:blue",
+            label="Fully vaccinated individuals (actual)"
+        )
+        line_forecasted, = ax.plot(
+            *forecasted,
+            color="tab:orange",
+            label="Fully vaccinated individuals (forecasted)"
+        )
+        ax.legend(loc="upper left")
+        ax.set_ylabel("Vaccinated Inviduals (in millions)")
+        ax.tick_params(axis="x", labelrotation=45)
+        st.session_state.forecast_fig = (fig, ax, line_actual, line_forecasted)
+    else:
+        # Reuse the session's figure and only swap the line data
+        fig, ax, line_actual, line_forecasted = st.session_state.forecast_fig
+        line_actual.set_data(*actual)
+        line_forecasted.set_data(*forecasted)
+        ax.relim()
+        ax.autoscale_view()
     ax.set_title(
         f"We expect to reach target herd immunity by "
         f"{herd_immunity_date.strftime('%b %d, %Y')}."
     )
-    plt.xticks(rotation=45)
-    st.pyplot(fig)
+    st.pyplot(fig, clear_figure=False)
     st.caption(f"Source: COVID-19 Dataset from Our World in Data ({data_source}).")
 
     st.markdown(
@@ -195,9 +355,10 @@ def methodology():
         "reflect the current vaccination rate in the Philippines by displaying the current number of vaccinated individuals."
     )
     st.markdown(
-        ":two: In forecasting, we utilized the Holt-Winters Exponential Smoothing statistical model. Note that"
-        " model parameters used were the default values of the model. To test the model's performance, tuning "
-        "will be implemented in future iterations."
+        ":two: In forecasting, we utilized the Holt-Winters Exponential Smoothing statistical model with an additive "
+        "trend and weekly multiplicative seasonality. The smoothing parameters are fixed, while the initial level, "
+        "trend and seasonal factors are fitted to the data by minimizing the squared one-step-ahead errors. To test "
+        "the model's performance, tuning will be implemented in future iterations."
     )
 
     st.markdown(
@@ -206,14 +367,14 @@ def methodology():
     )
 
 
-list_of_pages = [
+PAGES = (
     "Where We Are",
     "Forecast",
     "Methodology"
-]
+)
 
 st.sidebar.title(':scroll: Main Pages')
-selection = st.sidebar.radio("Go to: ", list_of_pages)
+selection = st.sidebar.radio("Go to: ", PAGES)
 
 if selection == "Where We Are":
     descriptive_analytics()